@@ -5,6 +5,7 @@ from utils.api_handlers import register_api_routes
 from utils.html_handlers import register_html_routes
 from utils.profile import enable_profiling
 from utils.directory_utils import set_allowed_directories
+from utils.io_scheduler import set_device_concurrency, set_prefetch_memory_limit
 
 SWAGGER_URL = '/api/docs'
 API_URL = '/openapi.yaml'
@@ -31,6 +32,20 @@ if __name__ == "__main__":
         action="store_true",
         help="プロファイリングを有効にする"
     )
+    parser.add_argument(
+        "--io-concurrency",
+        action="append",
+        default=[],
+        metavar="PATH=N",
+        help="PATH を含むデバイスの読み込みスレッド数を指定する（複数指定可）"
+    )
+    parser.add_argument(
+        "--prefetch-memory",
+        type=int,
+        default=256,
+        metavar="MB",
+        help="先読みバッファの上限（MB, default: 256）"
+    )
     args = parser.parse_args()
 
     # プロファイリングを有効にするかどうかを設定する
@@ -39,4 +54,14 @@ if __name__ == "__main__":
     # 指定されたディレクトリを絶対パスに変換して保持
     set_allowed_directories(args.directories)
 
+    # デバイスごとの読み込みスレッド数と先読みバッファの上限を設定
+    mounts = {}
+    for spec in args.io_concurrency:
+        path, sep, concurrency = spec.rpartition("=")
+        if not sep or not concurrency.isdigit():
+            parser.error(f"--io-concurrency は PATH=N の形式で指定してください: {spec}")
+        mounts[path] = int(concurrency)
+    set_device_concurrency(mounts)
+    set_prefetch_memory_limit(args.prefetch_memory * 1024 * 1024)
+
     app.run(host=args.host, port=args.port, debug=True)
@@ -28,6 +28,15 @@ async function fetchProgressData(): Promise<void> {
       `;
       stepsContainer.appendChild(stepElement);
     });
+
+    // デバイスごとの読み込みスループットを表示
+    const ioContainer = document.getElementById("io")!;
+    ioContainer.innerHTML = ""; // 既存の内容をクリア
+    Object.entries(data.io || {}).forEach(([device, io]: [string, any]) => {
+      const ioElement = document.createElement("div");
+      ioElement.textContent = `デバイス ${device}: ${io.mb_per_sec} MB/s (${io.files} 件)`;
+      ioContainer.appendChild(ioElement);
+    });
   } catch (error) {
     console.error("進捗データの取得中にエラーが発生しました:", error);
   }
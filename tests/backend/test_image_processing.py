@@ -0,0 +1,130 @@
+import gc
+import os
+import threading
+import tracemalloc
+from datetime import datetime
+
+import imagehash
+import pytest
+from PIL import Image
+
+from utils import image_processing
+from utils.image_processing import ImageFile, fill_metadata
+
+def make_image(path, exifdate: str = None) -> str:
+    img = Image.new("RGB", (32, 32), (200, 0, 0))
+    exif = img.getexif()
+    if exifdate:
+        exif[306] = exifdate
+    img.save(path, exif=exif)
+    return str(path)
+
+@pytest.fixture(autouse=True)
+def reset_hardlink_cache(monkeypatch):
+    monkeypatch.setattr(image_processing, "hardlink_ability_table", {})
+
+def test_metadata_is_not_loaded_until_needed(tmp_path):
+    image = ImageFile(make_image(tmp_path / "a.jpg", "2020:01:02 03:04:05"))
+    assert not image.disabled
+    assert image.metadata is None
+    assert image.exifdate == datetime(2020, 1, 2, 3, 4, 5)
+    assert image.metadata is not None
+    assert image.thumbnail
+
+def test_fill_metadata_probes_hardlink_once_per_device(tmp_path, monkeypatch):
+    images = [ImageFile(make_image(tmp_path / f"{i}.jpg")) for i in range(16)]
+    calls = []
+    link = os.link
+    def counting_link(src, dst):
+        calls.append(dst)
+        return link(src, dst)
+    monkeypatch.setattr(image_processing.os, "link", counting_link)
+    progress = []
+    fill_metadata(images, lambda done, total: progress.append((done, total)))
+    assert len(calls) == 1
+    assert all(image.metadata is not None for image in images)
+    assert progress[-1] == (16, 16)
+
+def test_load_metadata_waits_for_concurrent_load(tmp_path, monkeypatch):
+    image = ImageFile(make_image(tmp_path / "a.jpg", "2020:01:02 03:04:05"))
+    opened = threading.Event()
+    release = threading.Event()
+    open_image = Image.open
+    def slow_open(*args, **kwargs):
+        opened.set()
+        release.wait(5)
+        return open_image(*args, **kwargs)
+    monkeypatch.setattr(image_processing.Image, "open", slow_open)
+    loader = threading.Thread(target=image.load_metadata)
+    loader.start()
+    opened.wait(5)
+    results = []
+    reader = threading.Thread(target=lambda: results.append((image.exifdate, image.thumbnail)))
+    reader.start()
+    release.set()
+    loader.join()
+    reader.join()
+    assert results[0][0] == datetime(2020, 1, 2, 3, 4, 5)
+    assert results[0][1]
+
+def test_hardlink_probe_does_not_block_other_devices(tmp_path, monkeypatch):
+    path = make_image(tmp_path / "a.jpg")
+    image_processing.hardlink_ability_table[2] = True
+    probing = threading.Event()
+    release = threading.Event()
+    def slow_link(src, dst):
+        probing.set()
+        release.wait(5)
+        raise OSError("not supported")
+    monkeypatch.setattr(image_processing.os, "link", slow_link)
+    prober = threading.Thread(target=image_processing.hardlink_ability, args=(path, 1))
+    prober.start()
+    probing.wait(5)
+    results = []
+    other = threading.Thread(target=lambda: results.append(image_processing.hardlink_ability(path, 2)))
+    other.start()
+    other.join(1)
+    finished = not other.is_alive()
+    release.set()
+    prober.join()
+    other.join()
+    assert finished
+    assert results == [True]
+    assert image_processing.hardlink_ability_table[1] is False
+
+class EagerImageFile:
+    """
+    メタデータを遅延取得する前の ImageFile と同じ属性を持つ比較用のクラス。
+    """
+    def __init__(self, path: str) -> None:
+        st = os.stat(path)
+        self.paths = [path]
+        self.size = st.st_size
+        self.disabled = False
+        self.hash = imagehash.phash(Image.open(path))
+        self.exifdate = None
+        self.filedate = datetime.fromtimestamp(st.st_mtime)
+        self.inode = st.st_ino
+        self.hardlink_ability = True
+        self.device = st.st_dev
+        self.group = None
+
+def retained_bytes_per_file(factory, count: int = 500) -> float:
+    factory()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        files = [factory() for _ in range(count)]
+        gc.collect()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    assert len(files) == count
+    return sum(stat.size_diff for stat in after.compare_to(before, "filename")) / count
+
+def test_singleton_footprint_does_not_exceed_eager_layout(tmp_path):
+    path = make_image(tmp_path / "a.png")
+    lazy = retained_bytes_per_file(lambda: ImageFile(path))
+    eager = retained_bytes_per_file(lambda: EagerImageFile(path))
+    assert lazy <= eager
@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+
+import pytest
+
+from utils import io_scheduler
+from utils.io_scheduler import PrefetchReader, order_by_locality
+
+def make_stat(ino: int, dev: int, size: int = 0) -> os.stat_result:
+    return os.stat_result((0o100644, ino, dev, 1, 0, 0, size, 0, 0, 0))
+
+def write_files(tmp_path, sizes):
+    files = []
+    for i, size in enumerate(sizes):
+        path = tmp_path / f"{i}.bin"
+        path.write_bytes(bytes([i % 256]) * size)
+        files.append((str(path), os.stat(path)))
+    return files
+
+@pytest.fixture(autouse=True)
+def reset_settings(monkeypatch):
+    monkeypatch.setattr(io_scheduler, "device_concurrency", {})
+    monkeypatch.setattr(io_scheduler, "prefetch_memory_limit", 256 * 1024 * 1024)
+
+def test_order_by_locality_sorts_by_directory_and_inode(monkeypatch):
+    stats = {
+        "/b/x.jpg": make_stat(1, 1),
+        "/a/y.jpg": make_stat(9, 1),
+        "/a/z.jpg": make_stat(3, 1),
+    }
+    monkeypatch.setattr(io_scheduler, "_stat", lambda path: stats[path])
+    ordered = order_by_locality(list(stats))
+    assert [path for path, _ in ordered] == ["/a/z.jpg", "/a/y.jpg", "/b/x.jpg"]
+
+def test_order_by_locality_interleaves_devices(monkeypatch):
+    stats = {
+        "/nas/1.jpg": make_stat(1, 10),
+        "/nas/2.jpg": make_stat(2, 10),
+        "/nas/3.jpg": make_stat(3, 10),
+        "/local/1.jpg": make_stat(1, 20),
+    }
+    monkeypatch.setattr(io_scheduler, "_stat", lambda path: stats[path])
+    ordered = order_by_locality(list(stats))
+    assert [st.st_dev for _, st in ordered] == [10, 20, 10, 10]
+
+def test_order_by_locality_skips_missing_files_and_reports_progress(tmp_path):
+    files = [path for path, _ in write_files(tmp_path, [1, 2])] + [str(tmp_path / "missing.bin")]
+    progress = []
+    ordered = order_by_locality(files, [str(tmp_path)], lambda done, total: progress.append((done, total)))
+    assert len(ordered) == 2
+    assert progress[-1] == (3, 3)
+
+def test_order_by_locality_stats_follow_root_device_concurrency(tmp_path, monkeypatch):
+    # 探索ルートも含めて stat 結果はすべてデバイス 1 になる
+    monkeypatch.setattr(io_scheduler, "device_concurrency", {1: 2})
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+    def slow_stat(path):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+        return make_stat(1, 1)
+    files = [str(tmp_path / f"{i}.jpg") for i in range(20)]
+    monkeypatch.setattr(io_scheduler, "_stat", slow_stat)
+    assert len(order_by_locality(files, [str(tmp_path)])) == 20
+    assert peak[0] == 2
+
+class RecordingReader(PrefetchReader):
+    """
+    読み込み開始から呼び出し側の処理完了までに保持しているバイト数を記録する。
+    """
+    def __init__(self, files):
+        super().__init__(files)
+        self.held = 0
+        self.max_held = 0
+        self.record_lock = threading.Lock()
+
+    def _read(self, path, dev):
+        with self.record_lock:
+            self.held += os.path.getsize(path)
+            self.max_held = max(self.max_held, self.held)
+        return super()._read(path, dev)
+
+    def consume(self):
+        for path, st, data in self:
+            assert data is not None and len(data) == st.st_size
+            with self.record_lock:
+                self.held -= st.st_size
+
+def test_prefetch_reader_stays_within_memory_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(io_scheduler, "prefetch_memory_limit", 250)
+    reader = RecordingReader(write_files(tmp_path, [100] * 20))
+    reader.consume()
+    assert 0 < reader.max_held <= 250
+
+def test_prefetch_reader_lets_oversized_file_through(tmp_path, monkeypatch):
+    monkeypatch.setattr(io_scheduler, "prefetch_memory_limit", 250)
+    reader = RecordingReader(write_files(tmp_path, [100, 1000, 100]))
+    reader.consume()
+    assert reader.max_held == 1000
+
+def test_prefetch_reader_yields_none_on_read_failure(tmp_path):
+    files = write_files(tmp_path, [10, 10])
+    os.remove(files[0][0])
+    results = [(path, data) for path, _, data in PrefetchReader(files)]
+    assert results == [(files[0][0], None), (files[1][0], bytes([1]) * 10)]
+
+def test_throughput_shape(tmp_path):
+    files = write_files(tmp_path, [10, 20])
+    reader = PrefetchReader(files)
+    list(reader)
+    throughput = reader.throughput()
+    assert list(throughput) == [str(files[0][1].st_dev)]
+    io = throughput[str(files[0][1].st_dev)]
+    assert io["files"] == 2
+    assert io["bytes"] == 30
+    assert isinstance(io["mb_per_sec"], (int, float))
+
+def test_throughput_counts_only_busy_time():
+    stats = io_scheduler.DeviceStats()
+    stats.begin(0.0)
+    stats.end(1.0, 1_000_000)
+    # 読み込みのない待ち時間は含めない
+    stats.begin(10.0)
+    stats.begin(10.5)
+    stats.end(11.0, 1_000_000)
+    stats.end(12.0, 1_000_000)
+    assert stats.to_dict(100.0)["mb_per_sec"] == 1.0
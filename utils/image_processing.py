@@ -5,13 +5,19 @@ import threading
 import traceback
 import shutil
 from utils.profile import profile
+from utils.io_scheduler import DevicePools, PrefetchReader, order_by_locality
 from datetime import datetime
 from copy import deepcopy
 from io import BytesIO
-from typing import List, Any, Dict
+from concurrent.futures import as_completed
+from typing import List, Any, Callable, Dict
 from PIL import Image
 
 hardlink_ability_table: Dict[int, bool] = {}
+# デバイスごとの調査用ロック（同じデバイスを複数スレッドから同時に調査しないため）
+hardlink_ability_locks: Dict[int, threading.Lock] = {}
+# hardlink_ability_locks を更新するときだけ使う短いロック
+hardlink_ability_locks_lock = threading.Lock()
 
 def hardlink_ability(path: str, dev: int) -> bool:
     """
@@ -22,47 +28,72 @@ def hardlink_ability(path: str, dev: int) -> bool:
     """
     if dev in hardlink_ability_table:
         return hardlink_ability_table[dev]
-    # キャッシュがなければ実地調査する
-    if not os.path.exists(path):
-        # 判定不能
+    with hardlink_ability_locks_lock:
+        lock = hardlink_ability_locks.setdefault(dev, threading.Lock())
+    with lock:
+        # 待っている間に他のスレッドが調査を終えていればその結果を使う
+        if dev in hardlink_ability_table:
+            return hardlink_ability_table[dev]
+        # キャッシュがなければ実地調査する
+        if not os.path.exists(path):
+            # 判定不能
+            return False
+        # ハードリンクの作成を試みた結果を返す
+        # 返り値は hardlink_ability_table にキャッシュする
+        testpath = path + ".test"
+        try:
+            os.link(path, testpath)
+            os.remove(testpath)
+            hardlink_ability_table[dev] = True
+            return True
+        except OSError:
+            hardlink_ability_table[dev] = False
+        except Exception as e:
+            print(f"Cache create for device {dev}: {hardlink_ability_table}")
+            hardlink_ability_table[dev] = False
+            # 例外が発生した場合はハードリンクの作成ができないとみなす
+            # ただし、例外の内容によっては True を返すこともあるかもしれないので注意
+            # ここでは False を返す
         return False
-    # ハードリンクの作成を試みた結果を返す
-    # 返り値は hardlink_ability_table にキャッシュする
-    testpath = path + ".test"
-    try:
-        os.link(path, testpath)
-        os.remove(testpath)
-        hardlink_ability_table[dev] = True
-        return True
-    except OSError:
-        hardlink_ability_table[dev] = False
-    except Exception as e:
-        print(f"Cache create for device {dev}: {hardlink_ability_table}")
-        hardlink_ability_table[dev] = False
-        # 例外が発生した場合はハードリンクの作成ができないとみなす
-        # ただし、例外の内容によっては True を返すこともあるかもしれないので注意
-        # ここでは False を返す
-    return False
+
+class ImageMetadata:
+    """
+    重複が見つかった画像についてだけ取得する EXIF 日時とサムネイル。
+    """
+    def __init__(self, exifdate: datetime, thumbnail: str) -> None:
+        self.exifdate: datetime = exifdate
+        self.thumbnail: str = thumbnail
+
+# メタデータ読み込み用のロック（画像ごとにロックを持たないよう、id で振り分ける）
+metadata_locks: List[threading.Lock] = [threading.Lock() for _ in range(64)]
 
 class ImageFile:
     """
     画像ファイルに関する様々なを表すクラス。
+    EXIF 日時とサムネイルは重複が見つかったファイルにしか使わないので、
+    初めて参照されたとき（または fill_metadata() で一括取得したとき）に取得する。
     """
-    def __init__(self, path: str) -> None:
+    def __init__(self, path: str, data: bytes = None, st: os.stat_result = None) -> None:
+        """
+        :param path: ファイルパス
+        :param data: 先読み済みのファイル内容（None ならパスから読み込む）
+        :param st: 取得済みの stat 結果（None ならパスから取得する）
+        """
+        if st is None:
+            st = os.stat(path)
         self.paths: List[str] = [path]
-        self.size: int = os.path.getsize(path)
+        self.size: int = st.st_size
         self.disabled: bool = True
         self.hash: imagehash.ImageHash = None
-        self.exifdate: datetime.datetime = None
-        self.filedate: datetime.datetime = None
-        self.inode: int = None
-        self.hardlink_ability: bool = False
-        self.device: int = None
+        self.mtime: float = st.st_mtime
+        self.inode: int = st.st_ino
+        self.device: int = st.st_dev
         self.group: List[ImageFile] = None
+        self.metadata: ImageMetadata = None
 
         img: Image.Image = None
         try:
-            img = Image.open(path)
+            img = Image.open(BytesIO(data) if data is not None else path)
         except Exception as e:
             print(f"Error opening image {path}: {e}")
             return
@@ -72,37 +103,74 @@ class ImageFile:
             print(f"Error calculating hash for image {path}: {e}")
             return
         self.disabled = False
-        self.exifdate = None
-        exif_data = img.getexif()
-        date_str = exif_data.get(36867) or exif_data.get(306)
-        if date_str:
-            for fmt in [ "%Y:%m:%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]:
-                try:
-                    self.exifdate = datetime.strptime(date_str, fmt)
-                    break
-                except ValueError:
-                    continue
-            else:
-                print(f"Unsupported date format in {path}: {date_str}")
-        self.filedate = datetime.fromtimestamp(os.path.getmtime(path))
-        self.device = os.stat(path).st_dev
-        self.inode = os.stat(path).st_ino
-        self.hardlink_ability = hardlink_ability(path, self.device)
+
+    def load_metadata(self) -> ImageMetadata:
+        """
+        画像を開き直して EXIF 日時とサムネイルを取得する。
+        :return: 取得したメタデータ（取得済みならそれを返す）
+        """
+        if self.metadata is not None:
+            return self.metadata
+        # ワーカースレッドと API リクエストから同時に呼ばれても、読み込み途中の値を返さないようにする
+        with metadata_locks[id(self) % len(metadata_locks)]:
+            if self.metadata is not None:
+                return self.metadata
+            path = self.paths[0]
+            exifdate: datetime = None
+            thumbnail = ""
+            try:
+                with Image.open(path) as img:
+                    exif_data = img.getexif()
+                    date_str = exif_data.get(36867) or exif_data.get(306)
+                    if date_str:
+                        for fmt in [ "%Y:%m:%d %H:%M:%S", "%Y/%m/%d %H:%M:%S"]:
+                            try:
+                                exifdate = datetime.strptime(date_str, fmt)
+                                break
+                            except ValueError:
+                                continue
+                        else:
+                            print(f"Unsupported date format in {path}: {date_str}")
+                    img.thumbnail((128, 128))
+                    buffer = BytesIO()
+                    img.save(buffer, format="PNG")
+                    thumbnail = base64.b64encode(buffer.getvalue()).decode('utf-8')
+            except Exception as e:
+                print(f"Error generating thumbnail for {path}: {e}")
+            # すべて取得し終えてから公開する
+            self.metadata = ImageMetadata(exifdate, thumbnail)
+            return self.metadata
+
+    @property
+    def exifdate(self) -> datetime:
+        return self.load_metadata().exifdate
+
+    @exifdate.setter
+    def exifdate(self, value: datetime) -> None:
+        # 後から読み込んだ値で上書きされないよう、先に読み込んでおく
+        self.load_metadata().exifdate = value
+
+    @property
+    def filedate(self) -> datetime:
+        return datetime.fromtimestamp(self.mtime)
+
+    @filedate.setter
+    def filedate(self, value: datetime) -> None:
+        self.mtime = value.timestamp()
+
+    @property
+    def hardlink_ability(self) -> bool:
+        # 調査結果はデバイスごとに hardlink_ability_table にキャッシュされる
+        return hardlink_ability(self.paths[0], self.device)
+
+    @property
+    def thumbnail(self) -> str:
+        return self.load_metadata().thumbnail
 
     def to_dict(self) -> Dict[str, Any]:
         """
         画像ファイルの情報を辞書形式で返す。
         """
-        thumbnail = ""
-        try:
-            with Image.open(self.paths[0]) as img:
-                img.thumbnail((128, 128))
-                buffer = BytesIO()
-                img.save(buffer, format="PNG")
-                thumbnail = base64.b64encode(buffer.getvalue()).decode('utf-8')
-        except Exception as e:
-            print(f"Error generating thumbnail for {self.paths[0]}: {e}")
-
         return {
             "paths": self.paths,
             "size": self.size,
@@ -110,11 +178,40 @@ class ImageFile:
             "dateType": "exif" if self.exifdate else "file",
             "hardlink_ability": self.hardlink_ability,
             "device": self.device,
-            "thumbnail": thumbnail
+            "thumbnail": self.thumbnail
         }
 
     def __repr__(self) -> str:
-        return f"ImageFile({self.paths}, size={self.size}, hash={self.hash}, date={self.exifdate or self.filedate}({'exif' if self.exifdate else 'file'}), inode={self.inode})"
+        # repr のためだけにファイルを開かないよう、読み込み済みの値だけを使う
+        exifdate = self.metadata.exifdate if self.metadata else None
+        return f"ImageFile({self.paths}, size={self.size}, hash={self.hash}, date={exifdate or self.filedate}({'exif' if exifdate else 'file'}), inode={self.inode})"
+
+def fill_metadata(images: List[ImageFile], on_progress: Callable[[int, int], None] = None) -> None:
+    """
+    指定された画像のメタデータを並列に取得する。
+    読み込みはデバイスごとのスレッドプールで行い、マウントごとのスレッド数の指定に従う。
+    遅いデバイスを待つ間も、他のデバイスのプールは止まらずに処理を進める。
+    :param images: 対象の画像
+    :param on_progress: 1 件終えるごとに (完了件数, 全件数) を受け取るコールバック
+    """
+    def load(image: ImageFile) -> None:
+        image.load_metadata()
+        # ハードリンク可否も参照しておけば結果表示時に調査しなくて済む
+        image.hardlink_ability
+
+    pools = DevicePools("metadata")
+    try:
+        futures = [pools.submit(image.device, load, image) for image in images]
+        for done, future in enumerate(as_completed(futures), 1):
+            try:
+                future.result()
+            except Exception as e:
+                traceback.print_exc()
+                print(f"Error loading metadata: {e}")
+            if on_progress:
+                on_progress(done, len(images))
+    finally:
+        pools.shutdown()
 
 # グローバル変数で進捗状況を管理
 progress_init: Dict[str, Any] = {
@@ -127,7 +224,9 @@ progress_init: Dict[str, Any] = {
             {"name": "画像ファイルの一覧作成", "progress": 0, "status": "未開始"},
             {"name": "画像ファイルのハッシュ計算", "progress": 0, "status": "未開始"},
             {"name": "類似画像のグルーピング", "progress": 0, "status": "未開始"},
+            {"name": "重複画像の詳細取得", "progress": 0, "status": "未開始"},
         ],
+        "io": {},
         "group_list": []
     }
 
@@ -199,16 +298,23 @@ def background_image_processing(directory: List[str], algorithm: str, similarity
     progress_data["status"] = "ハッシュ計算中"
     progress_data["steps"][1]["status"] = "進行中"
     images: List[ImageFile] = []
-    for index, file_path in enumerate(image_files):
+    # ディレクトリ・inode 順に並べ替え、デバイスごとに先読みしながらデコードする
+    def on_stat_progress(done: int, total: int) -> None:
+        progress_data["message"] = f"ファイル情報を取得中: {done}/{total}"
+    ordered_files = order_by_locality(image_files, directory, on_stat_progress)
+    reader = PrefetchReader(ordered_files)
+    for index, (file_path, st, data) in enumerate(reader):
         try:
-            image = ImageFile(file_path)
+            image = ImageFile(file_path, data, st)
             if not image.disabled:
                 images.append(image)
-            progress_data["steps"][1]["progress"] = ((index + 1) * 10000 // len(image_files)) / 100
-            progress_data["message"] = f"ハッシュ計算中: {index + 1}/{len(image_files)}"
+            progress_data["steps"][1]["progress"] = ((index + 1) * 10000 // len(ordered_files)) / 100
+            progress_data["message"] = f"ハッシュ計算中: {index + 1}/{len(ordered_files)}"
+            progress_data["io"] = reader.throughput()
         except Exception as e:
             traceback.print_exc()
             print(f"Error processing image {file_path}: {e}")
+    progress_data["io"] = reader.throughput()
     progress_data["steps"][1]["status"] = "完了"
 
     # ステップ 3: 類似画像のグルーピング
@@ -238,8 +344,21 @@ def background_image_processing(directory: List[str], algorithm: str, similarity
     progress_data["steps"][2]["progress"] = 100
     progress_data["steps"][2]["status"] = "完了"
 
+    # ステップ 4: 重複画像の詳細取得
+    # EXIF 日時やサムネイルは結果に表示する重複画像の分だけ取得する
+    progress_data["status"] = "詳細取得中"
+    progress_data["steps"][3]["status"] = "進行中"
+    duplicate_groups = list(filter(lambda x: len(x) > 1 or len(x[0].paths) > 1, group_list))
+    duplicate_images = [img for group in duplicate_groups for img in group]
+    def on_metadata_progress(done: int, total: int) -> None:
+        progress_data["steps"][3]["progress"] = (done * 10000 // total) / 100
+        progress_data["message"] = f"詳細取得中: {done}/{total}"
+    fill_metadata(duplicate_images, on_metadata_progress)
+    progress_data["steps"][3]["progress"] = 100
+    progress_data["steps"][3]["status"] = "完了"
+
     # 重複画像のあるグループのみをリストに登録する
-    progress_data["group_list"] = list(map(lambda x: list(map(lambda y: y.to_dict(), x)), filter(lambda x: len(x) > 1 or len(x[0].paths) > 1, group_list)))
+    progress_data["group_list"] = list(map(lambda x: list(map(lambda y: y.to_dict(), x)), duplicate_groups))
     progress_data["message"] = f"画像探索処理が完了しました。イメージ数 {len(images)} 件、グループ数 {len(group_list)} 件、重複のあるグループは {len(progress_data['group_list'])} 件。"
     # 全体の進捗を完了に設定
     progress_data["progress"] = 100
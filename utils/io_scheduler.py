@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# デバイスごとの読み込みスレッド数の既定値
+DEFAULT_CONCURRENCY: int = 4
+
+# 先読みバッファの上限（バイト単位）
+prefetch_memory_limit: int = 256 * 1024 * 1024
+
+# デバイス番号ごとの読み込みスレッド数
+device_concurrency: Dict[int, int] = {}
+
+def set_device_concurrency(mounts: Dict[str, int]) -> None:
+    """
+    マウントポイントごとの読み込みスレッド数を設定する。
+    :param mounts: パスとスレッド数の対応表（パスはそのパスを含むデバイスを表す）
+    """
+    global device_concurrency
+    device_concurrency = {}
+    for path, concurrency in mounts.items():
+        try:
+            dev = os.stat(path).st_dev
+        except OSError as e:
+            print(f"Error resolving device for {path}: {e}")
+            continue
+        device_concurrency[dev] = max(1, concurrency)
+
+def set_prefetch_memory_limit(limit: int) -> None:
+    """
+    先読みバッファの上限を設定する。
+    :param limit: 上限（バイト単位）
+    """
+    global prefetch_memory_limit
+    prefetch_memory_limit = max(0, limit)
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError as e:
+        print(f"Error stat {path}: {e}")
+        return None
+
+def _root_device(path: str, root_devices: Dict[str, int]) -> Optional[int]:
+    # 最も長く一致する探索ルートのデバイスを返す
+    best = None
+    for root in root_devices:
+        if (path == root or path.startswith(root.rstrip(os.sep) + os.sep)) and (best is None or len(root) > len(best)):
+            best = root
+    return root_devices[best] if best is not None else None
+
+def order_by_locality(files: List[str], roots: List[str] = None, on_progress: Callable[[int, int], None] = None) -> List[Tuple[str, os.stat_result]]:
+    """
+    ファイルをデバイス・ディレクトリ・inode の順に並べる。
+    デバイスごとの並びは保ったまま、複数デバイスを交互に並べて同時に読めるようにする。
+    stat はネットワーク越しだと 1 件ごとに待たされるので、探索ルートのデバイスごとのスレッドプールで並列に行う。
+    スレッド数は読み込みと同じく device_concurrency に従う。
+    :param files: ファイルパスのリスト
+    :param roots: 探索したディレクトリのリスト（各ファイルの stat をどのデバイスのプールで行うかの判定に使う）
+    :param on_progress: stat を 1 件終えるごとに (完了件数, 全件数) を受け取るコールバック
+    :return: パスと stat 結果の組のリスト
+    """
+    root_devices: Dict[str, int] = {}
+    for root in roots or []:
+        st = _stat(root)
+        if st is not None:
+            root_devices[root] = st.st_dev
+    per_device: Dict[int, List[Tuple[str, os.stat_result]]] = {}
+    pools = DevicePools("stat")
+    try:
+        futures = [pools.submit(_root_device(path, root_devices), _stat, path) for path in files]
+        for index, (path, future) in enumerate(zip(files, futures)):
+            st = future.result()
+            if st is not None:
+                per_device.setdefault(st.st_dev, []).append((path, st))
+            if on_progress:
+                on_progress(index + 1, len(files))
+    finally:
+        pools.shutdown()
+    queues: List[Deque[Tuple[str, os.stat_result]]] = []
+    for entries in per_device.values():
+        entries.sort(key=lambda x: (os.path.dirname(x[0]), x[1].st_ino))
+        queues.append(deque(entries))
+    ordered: List[Tuple[str, os.stat_result]] = []
+    while queues:
+        for queue in list(queues):
+            ordered.append(queue.popleft())
+            if not queue:
+                queues.remove(queue)
+    return ordered
+
+class DeviceStats:
+    """
+    デバイスごとの読み込み量と所要時間を記録するクラス。
+    所要時間は読み込みが 1 件以上走っていた時間だけを数え、バッファの空き待ちの時間は含めない。
+    """
+    def __init__(self) -> None:
+        self.files: int = 0
+        self.bytes: int = 0
+        self.active: int = 0
+        self.busy_since: float = None
+        self.busy_time: float = 0
+
+    def begin(self, now: float) -> None:
+        """
+        読み込みの開始を記録する。
+        """
+        if self.active == 0:
+            self.busy_since = now
+        self.active += 1
+
+    def end(self, now: float, size: int) -> None:
+        """
+        読み込みの終了を記録する。
+        """
+        self.active -= 1
+        if self.active == 0:
+            self.busy_time += now - self.busy_since
+            self.busy_since = None
+        if size >= 0:
+            self.files += 1
+            self.bytes += size
+
+    def to_dict(self, now: float = None) -> Dict[str, Any]:
+        """
+        読み込み実績を辞書形式で返す。
+        :param now: 読み込み中の時間を含めるための現在時刻（time.monotonic() の値）
+        """
+        elapsed = self.busy_time
+        if self.busy_since is not None:
+            elapsed += (now if now is not None else time.monotonic()) - self.busy_since
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "mb_per_sec": round(self.bytes / elapsed / 1e6, 2) if elapsed > 0 else 0,
+        }
+
+class DevicePools:
+    """
+    デバイスごとのスレッドプールを束ねるクラス。
+    スレッド数は device_concurrency に従う。
+    """
+    def __init__(self, name: str) -> None:
+        """
+        :param name: スレッド名の接頭辞
+        """
+        self.name: str = name
+        self.pools: Dict[int, ThreadPoolExecutor] = {}
+
+    def submit(self, dev: Optional[int], fn: Callable[..., Any], *args: Any) -> Future:
+        """
+        指定されたデバイスのスレッドプールに処理を投入する。
+        :param dev: デバイス番号（None なら既定のスレッド数のプールを使う）
+        :param fn: 実行する関数
+        :return: 実行結果の Future
+        """
+        if dev not in self.pools:
+            workers = device_concurrency.get(dev, DEFAULT_CONCURRENCY)
+            self.pools[dev] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{self.name}-{dev}")
+        return self.pools[dev].submit(fn, *args)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        すべてのスレッドプールを終了する。
+        """
+        for pool in self.pools.values():
+            pool.shutdown(wait=wait)
+
+class PrefetchReader:
+    """
+    デバイスごとのスレッドプールでファイルを先読みし、メモリ上のバイト列として順に返すクラス。
+    """
+    def __init__(self, files: List[Tuple[str, os.stat_result]]) -> None:
+        self.files: List[Tuple[str, os.stat_result]] = files
+        self.pools: DevicePools = DevicePools("reader")
+        self.stats: Dict[int, DeviceStats] = {}
+        self.lock = threading.Lock()
+
+    def _submit(self, path: str, dev: int) -> Future:
+        with self.lock:
+            if dev not in self.stats:
+                self.stats[dev] = DeviceStats()
+        return self.pools.submit(dev, self._read, path, dev)
+
+    def _read(self, path: str, dev: int) -> bytes:
+        with self.lock:
+            self.stats[dev].begin(time.monotonic())
+        data = None
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        finally:
+            with self.lock:
+                self.stats[dev].end(time.monotonic(), len(data) if data is not None else -1)
+        return data
+
+    def throughput(self) -> Dict[str, Dict[str, Any]]:
+        """
+        デバイスごとの読み込みスループットを返す。
+        """
+        with self.lock:
+            now = time.monotonic()
+            return {str(dev): stats.to_dict(now) for dev, stats in self.stats.items()}
+
+    def __iter__(self) -> Iterator[Tuple[str, os.stat_result, Optional[bytes]]]:
+        """
+        ファイルを先読みしつつ、パス・stat 結果・内容の組を順に返す。
+        読み込みに失敗したファイルは内容を None として返す。
+        """
+        pending: Deque[Tuple[str, os.stat_result, Future]] = deque()
+        reserved = 0
+        index = 0
+        try:
+            while index < len(self.files) or pending:
+                # メモリ上限の範囲で先読みを投入する（何も保持していないときは上限を超えても 1 件は投入する）
+                while index < len(self.files):
+                    path, st = self.files[index]
+                    if reserved > 0 and reserved + st.st_size > prefetch_memory_limit:
+                        break
+                    pending.append((path, st, self._submit(path, st.st_dev)))
+                    reserved += st.st_size
+                    index += 1
+                path, st, future = pending.popleft()
+                try:
+                    data = future.result()
+                except OSError as e:
+                    print(f"Error reading {path}: {e}")
+                    data = None
+                yield path, st, data
+                # 呼び出し側がデコードを終えてからバッファ分を解放する
+                reserved -= st.st_size
+        finally:
+            for _, _, future in pending:
+                future.cancel()
+            self.pools.shutdown(wait=False)